@@ -1,35 +1,79 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import csv
 import json
-from collections import defaultdict
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, product
+from operator import attrgetter
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 
 try:
     import openpyxl
-    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.cell import Cell, WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment, NamedStyle
     from openpyxl.utils import get_column_letter
     from openpyxl.formatting.rule import CellIsRule
+    from openpyxl.writer.excel import ExcelWriter
     import pytz
     from datetime import datetime
 except ImportError:
     print("Required libraries not installed. Run 'pip install openpyxl pytz' and retry.", file=sys.stderr)
     sys.exit(1)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 NETBOX_URL = os.environ.get('NETBOX_URL') or os.environ.get('NETBOX_API')
 NETBOX_TOKEN = os.environ.get('NETBOX_TOKEN')
-EXCLUDED_ROLE_IDS = {2, 11}
+EXCLUDED_ROLE_IDS = frozenset({2, 11})
+FETCH_WORKERS = 10
+# xlsx (default) builds the formatted workbook; csv skips it and writes one flat
+# row per device for pipelines that only need the data.
+REPORT_FORMAT = (os.environ.get('REPORT_FORMAT') or 'xlsx').lower()
+# Optional zip level for the saved workbook: 0 stores it uncompressed, 1 is the
+# quickest deflate. Unset keeps openpyxl's default (deflate level 6).
+XLSX_COMPRESS_LEVEL = os.environ.get('XLSX_COMPRESS_LEVEL', '')
+ITEM_FIELDS = [
+    "name", "description", "site", "role", "location", "primary_ip", "platform",
+    "tenant", "contact", "serial", "custom_fields", "monitoring_required",
+]
 
 if not NETBOX_URL or not NETBOX_TOKEN:
     print("Missing NETBOX_URL (or NETBOX_API) or NETBOX_TOKEN environment variables.", file=sys.stderr)
     sys.exit(1)
 
+if REPORT_FORMAT not in ('xlsx', 'csv'):
+    print(f"Unsupported REPORT_FORMAT '{REPORT_FORMAT}'; expected 'xlsx' or 'csv'.", file=sys.stderr)
+    sys.exit(1)
+
+if XLSX_COMPRESS_LEVEL and XLSX_COMPRESS_LEVEL not in {str(level) for level in range(10)}:
+    print(f"Unsupported XLSX_COMPRESS_LEVEL '{XLSX_COMPRESS_LEVEL}'; expected 0-9.", file=sys.stderr)
+    sys.exit(1)
+
 headers = {
     'Authorization': f"Token {NETBOX_TOKEN}",
     'Accept': 'application/json',
 }
 
+session = requests.Session()
+session.headers.update(headers)
+# Keep enough pooled keep-alive connections for every concurrent page fetch,
+# and retry pages that hit a transient gateway error. The last response is
+# handed back rather than raised so raise_for_status() still reports it.
+retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504], raise_on_status=False)
+adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retries)
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
 HEADING_ORDER = [
     "Gateway/Router",
     "Switches",
@@ -88,376 +132,348 @@ DEVICE_ROLE_GROUPS = {
     },
 }
 
-def get_heading_and_subheading(role_id):
-    for heading, sub_map in DEVICE_ROLE_GROUPS.items():
-        for subheading, role_ids in sub_map.items():
-            if role_id in role_ids:
-                return heading, subheading
-    return "Other", "Other"
+# (heading, subheadings) pairs in report order, resolved once for the sheet loops.
+HEADING_SUB_ORDER = [(heading, tuple(DEVICE_ROLE_GROUPS[heading])) for heading in HEADING_ORDER]
+# Report order with the catch-all 'Other' section for unmapped roles appended;
+# the CSV, Summary and per-site writers all walk this.
+REPORT_ORDER = HEADING_SUB_ORDER + [("Other", ("Other",))]
+
+ROLE_INDEX = {
+    role_id: (heading, subheading)
+    for heading, sub_map in DEVICE_ROLE_GROUPS.items()
+    for subheading, role_ids in sub_map.items()
+    for role_id in role_ids
+}
+
+# Tick cells only ever take one of two glyph/font pairs, so build them once.
+TICK_YES = ("✓", Font(color="00AA00", bold=True))  # green
+TICK_NO = ("✗", Font(color="FF0000", bold=True))  # red
 
 def tick(val):
-    if val:
-        return "✓", "00AA00"  # green
-    else:
-        return "✗", "FF0000"  # red
+    return TICK_YES if val else TICK_NO
+
+# Rendered tick cells for every combination of the eight compliance checks, so a
+# device row's ticks are a single lookup on its compliance tuple.
+TICK_ROWS = {checks: tuple(tick(check) for check in checks) for checks in product((False, True), repeat=8)}
 
 def short_desc(desc, length=100):
-    if desc and len(desc) > length:
-        return desc[:length-3] + "..."
-    return desc or ""
+    if not desc:
+        return ""
+    return desc if len(desc) <= length else desc[:length-1] + "…"
+
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+def sheet_title(name, used):
+    # Excel sheet titles are limited to 31 characters, can't contain any of
+    # []:*?/\ and must be unique regardless of case.
+    base = INVALID_SHEET_CHARS.sub('_', name)[:31] or 'Sheet'
+    title, suffix = base, 1
+    while title.lower() in used:
+        title = f"{base[:28]}_{suffix}"
+        suffix += 1
+    used.add(title.lower())
+    return title
 
-site_device_counts = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: {'count': 0, 'devices': []})))
 device_debug_file = "/runner/device_debug.json"
-with open(device_debug_file, "w") as dbg:
-    dbg.write("")
 
-def fetch_netbox_items(url, item_type):
+# What the sheets need per device. The site/heading/subheading are the bucket
+# key, so they aren't repeated here. compliance holds the eight checks in column
+# order: Location, Primary IP, Platform, Tenant, Contact, Serial, Backup, Monitoring.
+DeviceRecord = namedtuple('DeviceRecord', ['name', 'description', 'compliance'])
+
+def fetch_page(url):
+    r = session.get(url, timeout=30)
+    r.raise_for_status()
+    if orjson:
+        return orjson.loads(r.content)
+    return r.json()
+
+def fetch_netbox_items(url):
+    # The first page tells us the total count and the page size NetBox actually
+    # honoured (limit is clamped to MAX_PAGE_SIZE), so the remaining offsets can
+    # be requested concurrently instead of walking 'next' one page at a time.
+    first = fetch_page(url)
+    pages = [first]
+    page_size = len(first.get('results', []))
+    if first.get('next') and page_size:
+        urls = [f"{url}&offset={offset}" for offset in range(page_size, first.get('count', 0), page_size)]
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            pages.extend(executor.map(fetch_page, urls))
+    # Devices and VMs come back from separate calls, so the caller keeps them
+    # apart rather than each item being tagged with its type.
     all_items = []
-    while url:
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        result = r.json()
-        for item in result.get('results', []):
-            item['_item_type'] = item_type
-            all_items.append(item)
-        url = result.get('next')
+    for result in pages:
+        all_items.extend(result.get('results', []))
     return all_items
 
-devices_url = f"{NETBOX_URL.rstrip('/')}/api/dcim/devices/?limit=1000&expand=role,site,tenant,contact,location,platform"
-devices = fetch_netbox_items(devices_url, "device")
-
-vms_url = f"{NETBOX_URL.rstrip('/')}/api/virtualization/virtual-machines/?limit=1000&expand=role,site,tenant,contact,location,platform"
-vms = fetch_netbox_items(vms_url, "vm")
-
-all_items = devices + vms
-
-for item in all_items:
-    with open(device_debug_file, "a") as dbg:
-        dbg.write(json.dumps(item, indent=2) + "\n\n")
-    site = item.get('site', {}).get('name', 'Unassigned Site')
-    status = item.get('status', {}).get('value') if isinstance(item.get('status'), dict) else item.get('status')
-    if status not in ('active', 1):
-        continue
-    role_id = None
-    item_role = item.get('role', None)
-    if isinstance(item_role, dict):
-        role_id = item_role.get('id', None)
-    elif isinstance(item_role, int):
-        role_id = item_role
-    else:
-        role_id = None
-    if role_id in EXCLUDED_ROLE_IDS:
-        continue
-    cf = item.get('custom_fields', {}) or {}
-
-    # Compliance checks (null check for expanded objects, dict or str)
-    location_present = bool(item.get('location'))
-    primary_ip_present = bool(item.get('primary_ip'))
-    platform_present = bool(item.get('platform'))
-    tenant_present = bool(item.get('tenant'))
-    contact_present = bool(item.get('contact'))
-    serial_present = bool(item.get('serial'))
-    backup_present = bool(cf.get('last_backup_data_prim'))
-    monitoring_present = (item.get('monitoring_required') if 'monitoring_required' in item else cf.get('mon_required')) is not False
-
-    device_info = {
-        'site': site,
-        'heading': None,
-        'subheading': None,
-        'name': item.get('name', 'Unknown Device'),
-        'description': item.get('description', ''),
-        'location_present': location_present,
-        'primary_ip_present': primary_ip_present,
-        'platform_present': platform_present,
-        'tenant_present': tenant_present,
-        'contact_present': contact_present,
-        'serial_present': serial_present,
-        'backup_present': backup_present,
-        'monitoring_present': monitoring_present,
-    }
-    if role_id is not None:
-        heading, subheading = get_heading_and_subheading(role_id)
-        device_info['heading'] = heading
-        device_info['subheading'] = subheading
-        site_device_counts[site][heading][subheading]['count'] += 1
-        site_device_counts[site][heading][subheading]['devices'].append(device_info)
+# Only active items outside the excluded roles are reported, so let NetBox
+# filter them out rather than downloading and discarding them here.
+item_filters = "status=active" + "".join(f"&role_id__n={role_id}" for role_id in sorted(EXCLUDED_ROLE_IDS))
+# Only request the attributes the report reads: 'fields' trims the payload on
+# NetBox 4.x, and older releases at least skip rendering config contexts.
+item_fields = "fields=" + ",".join(ITEM_FIELDS) + "&exclude=config_context"
+
+# limit=0 asks NetBox for its largest page: everything in one response when
+# MAX_PAGE_SIZE is unset, otherwise MAX_PAGE_SIZE items per concurrent page.
+devices_url = f"{NETBOX_URL.rstrip('/')}/api/dcim/devices/?limit=0&{item_filters}&{item_fields}"
+vms_url = f"{NETBOX_URL.rstrip('/')}/api/virtualization/virtual-machines/?limit=0&{item_filters}&{item_fields}"
+
+# The two endpoints are independent, so pull them at the same time.
+with ThreadPoolExecutor(max_workers=2) as executor:
+    devices_future = executor.submit(fetch_netbox_items, devices_url)
+    vms_future = executor.submit(fetch_netbox_items, vms_url)
+    devices = devices_future.result()
+    vms = vms_future.result()
+
+if os.environ.get('NETBOX_DEBUG'):
+    # Keyed by endpoint, since the trimmed fields don't say which one an item came from
+    debug_items = {"devices": devices, "virtual_machines": vms}
+    if orjson:
+        with open(device_debug_file, "wb") as dbg:
+            dbg.write(orjson.dumps(debug_items))
     else:
-        device_info['heading'] = "Other"
-        device_info['subheading'] = "Other"
-        site_device_counts[site]['Other']['Other']['count'] += 1
-        site_device_counts[site]['Other']['Other']['devices'].append(device_info)
-
-# ---- Excel Generation: One sheet per site, table per heading+subheading ----
-wb = openpyxl.Workbook()
-wb.remove(wb.active)  # Remove default sheet
-
-headers = [
+        with open(device_debug_file, "w") as dbg:
+            json.dump(debug_items, dbg)
+
+def aggregate(items, role_index):
+    # Kept as a function so the per-item loop works on locals rather than
+    # module globals.
+    buckets = {}
+    other = ("Other", "Other")
+    lookup = role_index.get
+    for item in items:
+        site = (item.get('site') or {}).get('name', 'Unassigned Site')
+        item_role = item.get('role')
+        role_id = item_role.get('id') if isinstance(item_role, dict) else item_role if isinstance(item_role, int) else None
+        cf = item.get('custom_fields', {}) or {}
+
+        # Compliance checks (null check for expanded objects, dict or str)
+        location_present = bool(item.get('location'))
+        primary_ip_present = bool(item.get('primary_ip'))
+        platform_present = bool(item.get('platform'))
+        tenant_present = bool(item.get('tenant'))
+        contact_present = bool(item.get('contact'))
+        serial_present = bool(item.get('serial'))
+        backup_present = bool(cf.get('last_backup_data_prim'))
+        monitoring_present = (item.get('monitoring_required') if 'monitoring_required' in item else cf.get('mon_required')) is not False
+
+        heading, subheading = lookup(role_id, other)
+        device = DeviceRecord(
+            # Unnamed devices come back as name: null, which would break the
+            # attrgetter('name') sort below.
+            item.get('name') or 'Unknown Device',
+            item.get('description', ''),
+            (
+                location_present,
+                primary_ip_present,
+                platform_present,
+                tenant_present,
+                contact_present,
+                serial_present,
+                backup_present,
+                monitoring_present,
+            ),
+        )
+        buckets.setdefault((site, heading, subheading), []).append(device)
+    return buckets
+
+# Devices grouped by (site, heading, subheading); the bucket size is the count.
+device_buckets = aggregate(chain(devices, vms), ROLE_INDEX)
+
+# Sort each bucket once so the sheet writers can iterate them directly.
+by_name = attrgetter('name')
+for devices in device_buckets.values():
+    devices.sort(key=by_name)
+sites = sorted({site for site, _, _ in device_buckets})
+
+# Column names shared by the CSV rows and the per-site device tables
+columns = [
     "Device Name", "Description", "Location", "Primary IP", "Platform", "Tenant", "Contact",
     "Serial", "Backup Data - Primary", "Monitoring Required"
 ]
 
+# ---- CSV Output: one row per device, in the same order as the sheets ----
+def write_csv_report(csv_file):
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Site", "Heading", "Subheading"] + columns)
+        for site in sites:
+            for heading, subheadings in REPORT_ORDER:
+                for subheading in subheadings:
+                    # Full descriptions and raw True/False checks, since this is
+                    # read by scripts rather than people.
+                    writer.writerows(
+                        (site, heading, subheading, device.name, device.description or "") + device.compliance
+                        for device in device_buckets.get((site, heading, subheading), ())
+                    )
+
+# ---- Excel Generation: One sheet per site, table per heading+subheading ----
+# Write-only mode streams rows into the file rather than holding a Cell object
+# per value. Column widths must be set before a sheet's first row is written,
+# so each sheet's rows are built as plain lists first and appended in one go.
 header_fill = PatternFill("solid", fgColor="00336699")
 header_font = Font(bold=True, color="FFFFFFFF")
 title_font = Font(bold=True, size=14)
 subhead_font = Font(bold=True, color="333399")
 grey_fill = PatternFill("solid", fgColor="DDDDDD")  # Light grey
+total_font = Font(bold=True, color="00336699")
+generated_font = Font(italic=True, color="888888")
+center_alignment = Alignment(horizontal="center", vertical="center")
+low_compliance_fill = PatternFill(start_color='FF9999', end_color='FF9999', fill_type='solid')  # < 80%
+mid_compliance_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')  # 80-95%
+high_compliance_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')  # >= 95%
+
+# Header cells share one registered style, so each is tagged by name rather
+# than having its font, fill and alignment assigned separately.
+header_style = NamedStyle(name="Report Header", font=header_font, fill=header_fill, alignment=center_alignment)
 
-# ---- Add Summary Worksheet ----
-summary_ws = wb.create_sheet(title="Summary", index=0)
 summary_headers = [
     "Site", "Heading", "Subheading", "Device Count",
     "% Location ✓", "% Primary IP ✓", "% Platform ✓", "% Tenant ✓",
     "% Contact ✓", "% Serial ✓", "% Backup ✓", "% Monitoring ✓"
 ]
-summary_ws.append(summary_headers)
-for cell in summary_ws[1]:
-    cell.font = header_font
-    cell.fill = header_fill
-    cell.alignment = Alignment(horizontal="center", vertical="center")
-
-summary_rows = []
-for site in sorted(site_device_counts):
-    for heading in HEADING_ORDER + ["Other"]:
-        if heading not in site_device_counts[site]:
-            continue
-        sub_map = DEVICE_ROLE_GROUPS.get(heading, {"Other": []}) if heading != "Other" else {"Other": []}
-        for subheading in (sub_map if heading != "Other" else ["Other"]):
-            devices = site_device_counts[site][heading][subheading]['devices'] if subheading in site_device_counts[site][heading] else []
-            count = len(devices)
-            if count == 0:
-                continue
-            location_tick = sum(1 for d in devices if d.get('location_present'))
-            primary_ip_tick = sum(1 for d in devices if d.get('primary_ip_present'))
-            platform_tick = sum(1 for d in devices if d.get('platform_present'))
-            tenant_tick = sum(1 for d in devices if d.get('tenant_present'))
-            contact_tick = sum(1 for d in devices if d.get('contact_present'))
-            serial_tick = sum(1 for d in devices if d.get('serial_present'))
-            backup_tick = sum(1 for d in devices if d.get('backup_present'))
-            monitor_tick = sum(1 for d in devices if d.get('monitoring_present'))
-            row = [
-                site,
-                heading,
-                subheading,
-                count,
-                (location_tick/count) if count else 0,
-                (primary_ip_tick/count) if count else 0,
-                (platform_tick/count) if count else 0,
-                (tenant_tick/count) if count else 0,
-                (contact_tick/count) if count else 0,
-                (serial_tick/count) if count else 0,
-                (backup_tick/count) if count else 0,
-                (monitor_tick/count) if count else 0,
-            ]
-            summary_ws.append(row)
-            summary_rows.append(row)
-
-# ---- Add Totals Across Sites Row ----
-total_count = 0
-total_location_tick = 0
-total_primary_ip_tick = 0
-total_platform_tick = 0
-total_tenant_tick = 0
-total_contact_tick = 0
-total_serial_tick = 0
-total_backup_tick = 0
-total_monitor_tick = 0
-
-for row in summary_rows:
-    count = int(row[3] or 0)
-    total_count += count
-    try:
-        total_location_tick   += count * float(row[4] or 0)
-        total_primary_ip_tick += count * float(row[5] or 0)
-        total_platform_tick   += count * float(row[6] or 0)
-        total_tenant_tick     += count * float(row[7] or 0)
-        total_contact_tick    += count * float(row[8] or 0)
-        total_serial_tick     += count * float(row[9] or 0)
-        total_backup_tick     += count * float(row[10] or 0)
-        total_monitor_tick    += count * float(row[11] or 0)
-    except Exception:
-        pass
-
-if total_count > 0:
-    total_row = [
-        "ALL SITES",
-        "",
-        "",
-        total_count,
-        total_location_tick/total_count,
-        total_primary_ip_tick/total_count,
-        total_platform_tick/total_count,
-        total_tenant_tick/total_count,
-        total_contact_tick/total_count,
-        total_serial_tick/total_count,
-        total_backup_tick/total_count,
-        total_monitor_tick/total_count
+
+def styled_cell(ws, value, font=None, fill=None, alignment=None, number_format=None, style=None):
+    cell = WriteOnlyCell(ws, value=value)
+    if style:
+        cell.style = style
+    if font:
+        cell.font = font
+    if fill:
+        cell.fill = fill
+    if alignment:
+        cell.alignment = alignment
+    if number_format:
+        cell.number_format = number_format
+    return cell
+
+def merge_row(ws, row, last_column):
+    ws.merged_cells.add(f"A{row}:{get_column_letter(last_column)}{row}")
+
+def write_rows(ws, rows):
+    # Auto-size columns from the longest value in each, capped at 50
+    widths = {}
+    for row in rows:
+        for col_idx, value in enumerate(row, 1):
+            if isinstance(value, Cell):
+                value = value.value
+            widths[col_idx] = max(widths.get(col_idx, 0), len(str(value)) if value else 0)
+    for col_idx, width in widths.items():
+        ws.column_dimensions[get_column_letter(col_idx)].width = min(width + 4, 50)
+    for row in rows:
+        ws.append(row)
+
+def summary_cells(ws, row, font=None, alignment=None):
+    # Rows carry raw tick counts in columns E-L; write them as a percentage of
+    # the device count in column D.
+    count = row[3]
+    values = row[:4] + [(tick_count/count) if count else 0 for tick_count in row[4:]]
+    return [
+        styled_cell(ws, value, font, None, alignment, '0.0%' if col_idx >= 5 else None)
+        for col_idx, value in enumerate(values, 1)
     ]
-else:
-    total_row = ["ALL SITES", "", "", 0, 0, 0, 0, 0, 0, 0, 0, 0]
-
-summary_ws.append(total_row)
-for col_idx in range(1, summary_ws.max_column + 1):
-    cell = summary_ws.cell(row=summary_ws.max_row, column=col_idx)
-    cell.font = Font(bold=True, color="00336699")
-    cell.alignment = Alignment(horizontal="center", vertical="center")
-
-# ---- Set Percentage Format ----
-for row in summary_ws.iter_rows(min_row=2, max_row=summary_ws.max_row, min_col=5, max_col=12):
-    for cell in row:
-        cell.number_format = '0.0%'
-
-# ---- Conditional Formatting for Compliance % Columns ----
-last_row = summary_ws.max_row
-for col_letter in ['E', 'F', 'G', 'H', 'I', 'J', 'K', 'L']:
+
+def device_table_rows(ws, title, devices):
+    rows = [
+        [styled_cell(ws, title, subhead_font)],
+        [styled_cell(ws, head, style=header_style.name) for head in columns],
+    ]
+    for device in devices:
+        # Rows are appended once and never changed, so build them as tuples.
+        rows.append((
+            device.name,
+            short_desc(device.description, 100),
+            *(
+                styled_cell(ws, value, font, grey_fill if idx in (9, 10) else None, center_alignment)  # I and J grey
+                for idx, (value, font) in enumerate(TICK_ROWS[device.compliance], start=3)  # Columns C-J
+            ),
+        ))
+    rows.append([])
+    return rows
+
+def write_xlsx_report(excel_file):
+    wb = openpyxl.Workbook(write_only=True)
+    wb.add_named_style(header_style)
+
+    # ---- Add Summary Worksheet ----
+    summary_ws = wb.create_sheet(title="Summary")
+    summary_sheet_rows = [[styled_cell(summary_ws, head, style=header_style.name) for head in summary_headers]]
+    # Running device count and per-check tick totals for the ALL SITES row
+    totals = [0] * 9
+    for site in sites:
+        for heading, subheadings in REPORT_ORDER:
+            for subheading in subheadings:
+                devices = device_buckets.get((site, heading, subheading))
+                if not devices:
+                    continue
+                count = len(devices)
+                # One pass over the devices: transpose the compliance tuples into
+                # columns and let sum() count the ticks in each.
+                tick_counts = [sum(column) for column in zip(*(d.compliance for d in devices))]
+                summary_sheet_rows.append(summary_cells(summary_ws, [site, heading, subheading, count] + tick_counts))
+                totals = [total + value for total, value in zip(totals, [count] + tick_counts)]
+
+    # ---- Add Totals Across Sites Row ----
+    summary_sheet_rows.append(summary_cells(summary_ws, ["ALL SITES", "", ""] + totals, total_font, center_alignment))
+
+    # ---- Conditional Formatting for Compliance % Columns ----
+    # One range covering every ratio column, so each threshold is a single rule
+    compliance_range = f"E2:L{len(summary_sheet_rows)}"
     summary_ws.conditional_formatting.add(
-        f"{col_letter}2:{col_letter}{last_row}",
-        CellIsRule(operator='lessThan', formula=['0.8'], fill=PatternFill(start_color='FF9999', end_color='FF9999', fill_type='solid'))
+        compliance_range,
+        CellIsRule(operator='lessThan', formula=['0.8'], fill=low_compliance_fill)
     )
     summary_ws.conditional_formatting.add(
-        f"{col_letter}2:{col_letter}{last_row}",
-        CellIsRule(operator='between', formula=['0.8', '0.95'], fill=PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid'))
+        compliance_range,
+        CellIsRule(operator='between', formula=['0.8', '0.95'], fill=mid_compliance_fill)
     )
     summary_ws.conditional_formatting.add(
-        f"{col_letter}2:{col_letter}{last_row}",
-        CellIsRule(operator='greaterThanOrEqual', formula=['0.95'], fill=PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid'))
+        compliance_range,
+        CellIsRule(operator='greaterThanOrEqual', formula=['0.95'], fill=high_compliance_fill)
     )
 
-# ---- Add Report Generation Date/Time (AEST/AEDT) ----
-tz = pytz.timezone("Australia/Melbourne")
-dt_row = summary_ws.max_row + 2
-report_dt = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S %Z')
-summary_ws.cell(row=dt_row, column=1, value=f"Report generated: {report_dt}")
-summary_ws.merge_cells(start_row=dt_row, start_column=1, end_row=dt_row, end_column=summary_ws.max_column)
-summary_ws[f"A{dt_row}"].font = Font(italic=True, color="888888")
-
-# Auto-size columns for summary
-for col_idx in range(1, summary_ws.max_column + 1):
-    col_letter = get_column_letter(col_idx)
-    max_length = 0
-    for row in summary_ws.iter_rows(min_row=1, max_row=summary_ws.max_row, min_col=col_idx, max_col=col_idx):
-        for cell in row:
-            try:
-                if cell.value and len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except Exception:
-                pass
-    summary_ws.column_dimensions[col_letter].width = min(max_length + 4, 50)
-
-# ---- Per-Site Worksheets ----
-for site in sorted(site_device_counts):
-    ws = wb.create_sheet(title=site[:31])
-    ws.append([f"{site} Device Report"])
-    ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=len(headers))
-    ws['A1'].font = title_font
-    rownum = 2
-
-    for heading in HEADING_ORDER:
-        if heading not in site_device_counts[site]:
-            continue
-        for subheading in DEVICE_ROLE_GROUPS[heading]:
-            devices = site_device_counts[site][heading][subheading]['devices']
-            if not devices:
-                continue
-            ws.append([f"{heading} - {subheading}"])
-            ws.merge_cells(start_row=rownum, start_column=1, end_row=rownum, end_column=len(headers))
-            ws[f'A{rownum}'].font = subhead_font
-            rownum += 1
-
-            # Table header
-            for colidx, head in enumerate(headers, 1):
-                cell = ws.cell(row=rownum, column=colidx, value=head)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-            rownum += 1
-
-            # Devices for this role/subheading
-            for device in sorted(devices, key=lambda d: d['name']):
-                ws.append([
-                    device['name'],
-                    short_desc(device.get('description', ''), 100),
-                    "", "", "", "", "", "", "", "",  # Placeholders for 8 ticks/crosses
-                ])
-                current_row = ws.max_row
-                # Order: Location, Primary IP, Platform, Tenant, Contact, Serial, Backup, Monitoring
-                tick_values = [
-                    tick(device.get('location_present')),
-                    tick(device.get('primary_ip_present')),
-                    tick(device.get('platform_present')),
-                    tick(device.get('tenant_present')),
-                    tick(device.get('contact_present')),
-                    tick(device.get('serial_present')),
-                    tick(device.get('backup_present')),
-                    tick(device.get('monitoring_present')),
-                ]
-                for idx, (value, color) in enumerate(tick_values, start=3):  # Columns C-J
-                    cell = ws.cell(row=current_row, column=idx)
-                    cell.value = value
-                    cell.font = Font(color=color, bold=True)
-                    cell.alignment = Alignment(horizontal="center", vertical="center")
-                    if idx in [9, 10]:  # I and J
-                        cell.fill = grey_fill
-                rownum += 1
-
-            ws.append([])
-            rownum += 1
-
-    # ---- Add "Other - Other" table if present ----
-    other_devices = site_device_counts[site].get('Other', {}).get('Other', {}).get('devices', [])
-    if other_devices:
-        ws.append(["Other - Other"])
-        ws.merge_cells(start_row=rownum, start_column=1, end_row=rownum, end_column=len(headers))
-        ws[f'A{rownum}'].font = subhead_font
-        rownum += 1
-
-        for colidx, head in enumerate(headers, 1):
-            cell = ws.cell(row=rownum, column=colidx, value=head)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        rownum += 1
-
-        for device in sorted(other_devices, key=lambda d: d['name']):
-            ws.append([
-                device['name'],
-                short_desc(device.get('description', ''), 100),
-                "", "", "", "", "", "", "", "", ""
-            ])
-            current_row = ws.max_row
-            tick_values = [
-                tick(device.get('location_present')),
-                tick(device.get('primary_ip_present')),
-                tick(device.get('platform_present')),
-                tick(device.get('tenant_present')),
-                tick(device.get('contact_present')),
-                tick(device.get('serial_present')),
-                tick(device.get('backup_present')),
-                tick(device.get('monitoring_present')),
-            ]
-            for idx, (value, color) in enumerate(tick_values, start=3):  # Columns C-J
-                cell = ws.cell(row=current_row, column=idx)
-                cell.value = value
-                cell.font = Font(color=color, bold=True)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if idx in [9, 10]:  # I and J
-                    cell.fill = grey_fill
-            rownum += 1
-        ws.append([])
-        rownum += 1
-
-    # Auto-size columns (skip merged cells)
-    for col_idx in range(1, ws.max_column + 1):
-        col_letter = get_column_letter(col_idx)
-        max_length = 0
-        for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=col_idx, max_col=col_idx):
-            for cell in row:
-                try:
-                    if cell.value and len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except Exception:
-                    pass
-        ws.column_dimensions[col_letter].width = min(max_length + 4, 50)
-
-excel_file = "/runner/cmdb_device_report.xlsx"
-wb.save(excel_file)
-print("Excel report generated:", excel_file)
+    # ---- Add Report Generation Date/Time (AEST/AEDT) ----
+    tz = pytz.timezone("Australia/Melbourne")
+    report_dt = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S %Z')
+    summary_sheet_rows.append([])
+    summary_sheet_rows.append([styled_cell(summary_ws, f"Report generated: {report_dt}", generated_font)])
+    merge_row(summary_ws, len(summary_sheet_rows), len(summary_headers))
+
+    write_rows(summary_ws, summary_sheet_rows)
+
+    # ---- Per-Site Worksheets ----
+    used_titles = {summary_ws.title.lower()}
+    for site in sites:
+        ws = wb.create_sheet(title=sheet_title(site, used_titles))
+        rows = [[styled_cell(ws, f"{site} Device Report", title_font)]]
+        merge_row(ws, 1, len(columns))
+
+        for heading, subheadings in REPORT_ORDER:
+            for subheading in subheadings:
+                devices = device_buckets.get((site, heading, subheading))
+                if not devices:
+                    continue
+                merge_row(ws, len(rows) + 1, len(columns))
+                rows.extend(device_table_rows(ws, f"{heading} - {subheading}", devices))
+
+        write_rows(ws, rows)
+
+    if XLSX_COMPRESS_LEVEL:
+        # wb.save() always deflates at the default level, so hand ExcelWriter an
+        # archive opened with the requested one. This mirrors openpyxl's
+        # save_workbook(), including stamping the modified date (naive UTC).
+        level = int(XLSX_COMPRESS_LEVEL)
+        with ZipFile(excel_file, 'w', ZIP_DEFLATED if level else ZIP_STORED, allowZip64=True, compresslevel=level or None) as archive:
+            wb.properties.modified = datetime.now(pytz.utc).replace(tzinfo=None)
+            ExcelWriter(wb, archive).save()
+    else:
+        wb.save(excel_file)
+
+if REPORT_FORMAT == 'csv':
+    csv_file = "/runner/cmdb_device_report.csv"
+    write_csv_report(csv_file)
+    print("CSV report generated:", csv_file)
+else:
+    excel_file = "/runner/cmdb_device_report.xlsx"
+    write_xlsx_report(excel_file)
+    print("Excel report generated:", excel_file)